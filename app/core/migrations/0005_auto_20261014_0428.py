@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-14 04:28
+
+from django.db import migrations, models
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """Merge tags sharing a user and name into the oldest of them."""
+    Tag = apps.get_model('core', 'Tag')
+    Through = apps.get_model('core', 'Recipe').tags.through
+    duplicates = Tag.objects.values('user_id', 'name').annotate(
+        keep_id=models.Min('id'), count=models.Count('id'),
+    ).filter(count__gt=1)
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        extra_ids = list(Tag.objects.filter(
+            user_id=duplicate['user_id'], name=duplicate['name'],
+        ).exclude(id=keep_id).values_list('id', flat=True))
+        # move the extras' recipes to the kept tag, once per recipe
+        recipe_ids = set(Through.objects.filter(
+            tag_id__in=extra_ids,
+        ).values_list('recipe_id', flat=True))
+        recipe_ids.difference_update(Through.objects.filter(
+            tag_id=keep_id,
+        ).values_list('recipe_id', flat=True))
+        Through.objects.bulk_create([
+            Through(recipe_id=recipe_id, tag_id=keep_id)
+            for recipe_id in recipe_ids
+        ])
+        Tag.objects.filter(id__in=extra_ids).delete()
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # run the deferred FK checks now, or ALTER TABLE below fails with
+        # "pending trigger events"
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='tag',
+            options={'ordering': ['-name']},
+        ),
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='uniq_tag_user_name'),
+        ),
+    ]
@@ -65,6 +65,16 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            # covers filtering by user and listing newest first
+            models.Index(
+                fields=['user', '-id'], name='recipe_user_id_desc_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.title
@@ -76,13 +86,19 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         self.name = self.name.strip().lower()
         super().save(*args, **kwargs)
 
     class Meta:
-        unique_together = ('name', 'user')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='uniq_tag_user_name',
+            ),
+        ]
         ordering = ['-name']
 
     def __str__(self):
@@ -0,0 +1,40 @@
+"""
+Signal handlers for the core app.
+"""
+
+from django.db.models.signals import (
+    m2m_changed,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Recipe, Tag
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tagged_recipes(sender, instance, created=False, **kwargs):
+    """Bump the recipes rendering a tag that is renamed or deleted."""
+    if not created:
+        Recipe.objects.filter(tags=instance).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_retagged_recipes(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """Bump the recipes whose tags are added, removed or cleared."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if pk_set is not None and not pk_set:
+        # add() of links that already exist
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif pk_set is None:
+        # a tag's recipes are cleared; bump them while they are linked
+        recipes = Recipe.objects.filter(tags=instance)
+    else:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    recipes.update(updated_at=timezone.now())
@@ -2,14 +2,33 @@
 Serializers for recipe APIs.
 """
 
+import copy
+from itertools import chain
+
+from django.db import models, transaction
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 from core.models import (
     Recipe,
     Tag,
 )
 
-class TagSerializer(serializers.ModelSerializer):
+
+class CachedFieldsMixin:
+    """Build a serializer's fields once per class and copy them after."""
+    _fields_cache = {}
+
+    def get_fields(self):
+        """Return a fresh copy of the fields built for this class."""
+        cls = type(self)
+        fields = self._fields_cache.get(cls)
+        if fields is None:
+            fields = self._fields_cache[cls] = super().get_fields()
+        return copy.deepcopy(fields)
+
+
+class TagSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     """Serializer for tags."""
 
     class Meta:
@@ -17,7 +36,64 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
         read_only_fields = ['id']
 
-class RecipeSerializer(serializers.ModelSerializer):
+    def validate_name(self, value):
+        """Normalise the name and reject renames onto an existing tag."""
+        name = value.strip().lower()
+        # nested in a recipe payload, an existing name is simply reused
+        if isinstance(self.instance, Tag) and Tag.objects.filter(
+            user_id=self.instance.user_id, name=name,
+        ).exclude(pk=self.instance.pk).exists():
+            raise serializers.ValidationError(
+                'A tag with this name already exists.'
+            )
+        return name
+
+class BulkRecipeListSerializer(serializers.ListSerializer):
+    """List serializer creating many recipes in a few queries."""
+    batch_size = 500
+    max_length = 100
+
+    def to_internal_value(self, data):
+        """Reject oversized lists before validating any of their items."""
+        if isinstance(data, list) and len(data) > self.max_length:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    f'Ensure this list has at most {self.max_length} items.'
+                ]
+            }, code='max_length')
+        return super().to_internal_value(data)
+
+    @transaction.atomic
+    def create(self, validated_data):
+        """Create the recipes, their tags and the links between them."""
+        names = [
+            self.child._tag_names(attrs.pop('tags', []))
+            for attrs in validated_data
+        ]
+        recipes = Recipe.objects.bulk_create(
+            [Recipe(**attrs) for attrs in validated_data],
+            batch_size=self.batch_size,
+        )
+
+        all_names = list(dict.fromkeys(chain.from_iterable(names)))
+        if all_names:
+            tag_ids = {
+                tag_obj.name: tag_obj.id
+                for tag_obj in self.child._get_or_create_tags(all_names)
+            }
+            through = Recipe.tags.through
+            through.objects.bulk_create(
+                [through(recipe_id=recipe.id, tag_id=tag_ids[name])
+                 for recipe, recipe_names in zip(recipes, names)
+                 for name in recipe_names],
+                batch_size=self.batch_size,
+            )
+
+        models.prefetch_related_objects(recipes, 'tags')
+        return recipes
+
+
+class RecipeSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     """Serializer for recipes."""
     tags = TagSerializer(many=True, required=False) # nested serializer
 
@@ -25,22 +101,54 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ['id', 'title', 'time_minutes', 'price', 'link', 'tags']
         read_only_fields = ['id']
+        list_serializer_class = BulkRecipeListSerializer
 
-    def _get_or_create_tags(self, tags, recipe):
-        """Handle getting or creating tags."""
+    def _tag_names(self, tags):
+        """Return the normalised, de-duplicated names of tags."""
+        # bulk_create() bypasses Tag.save(), so normalise names here
+        return list(dict.fromkeys(
+            tag['name'].strip().lower() for tag in tags
+        ))
+
+    def _get_or_create_tags(self, names):
+        """Return the user's tags with the given names, creating missing."""
         auth_user = self.context['request'].user
-        for tag in tags:
-            tag_obj, _ = Tag.objects.get_or_create(
-                user=auth_user,
-                **tag,
+        tag_objs = list(Tag.objects.filter(user=auth_user, name__in=names))
+        existing_names = {tag_obj.name for tag_obj in tag_objs}
+        missing = [
+            Tag(user=auth_user, name=name)
+            for name in names if name not in existing_names
+        ]
+        if missing:
+            # ignore_conflicts leaves pks unset, so fetch the rows again
+            Tag.objects.bulk_create(missing, ignore_conflicts=True)
+            tag_objs = list(
+                Tag.objects.filter(user=auth_user, name__in=names)
             )
-            recipe.tags.add(tag_obj)
+        return tag_objs
+
+    def _add_tags(self, names, recipe):
+        """Link the tags with the given names to a recipe."""
+        if not names:
+            return
+
+        # add() sends m2m_changed, which versions the recipe list
+        recipe.tags.add(*self._get_or_create_tags(names))
 
     def create(self, validated_data):
         """Create a recipe"""
         tags = validated_data.pop('tags', [])
         recipe = Recipe.objects.create(**validated_data)
-        self._get_or_create_tags(tags, recipe)
+        names = self._tag_names(tags)
+        if names:
+            # the new row's auto_now already versions the recipe list, so
+            # insert the links directly instead of add() and its m2m_changed
+            # bump
+            through = Recipe.tags.through
+            through.objects.bulk_create([
+                through(recipe_id=recipe.id, tag_id=tag_obj.id)
+                for tag_obj in self._get_or_create_tags(names)
+            ])
         return recipe
 
     def update(self, instance, validated_data):
@@ -48,16 +156,48 @@ class RecipeSerializer(serializers.ModelSerializer):
         # update tags
         tags = validated_data.pop('tags', None)
         if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
+            # only touch the links that actually change; the viewset
+            # prefetches tags, so reading the current ones is free
+            current = {tag.name: tag.id for tag in instance.tags.all()}
+            wanted = self._tag_names(tags)
+            wanted_set = set(wanted)
+            to_remove = [
+                tag_id for name, tag_id in current.items()
+                if name not in wanted_set
+            ]
+            if to_remove:
+                instance.tags.remove(*to_remove)
+            to_add = [name for name in wanted if name not in current]
+            self._add_tags(to_add, instance)
 
-        # update other fields
+        # update other fields, writing only the columns that were sent
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
 
-        instance.save()
+        update_fields = list(validated_data)
+        if update_fields:
+            # auto_now is only written when listed in update_fields
+            update_fields.append('updated_at')
+        instance.save(update_fields=update_fields)
         return instance
 
+
+class TagListSerializer(TagSerializer):
+    """Read-only serializer for listing tags."""
+
+    class Meta(TagSerializer.Meta):
+        read_only_fields = TagSerializer.Meta.fields
+
+
+class RecipeListSerializer(RecipeSerializer):
+    """Read-only serializer for listing recipes."""
+    # only describes the schema; RecipeViewSet.list renders the rows itself
+    tags = TagSerializer(many=True, read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        read_only_fields = RecipeSerializer.Meta.fields
+
+
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer for recipe details view."""
 
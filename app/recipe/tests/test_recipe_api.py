@@ -3,12 +3,14 @@ Tests for recipe APIs.
 """
 
 from decimal import Decimal
-import tempfile
+from functools import lru_cache
+import io
 import os
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 from django.urls import reverse
 
@@ -20,32 +22,49 @@ from core.models import (
     Tag
 )
 
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.serializers import (
+    BulkRecipeListSerializer,
+    RecipeSerializer,
+    RecipeDetailSerializer,
+)
 
 RECIPES_URL = reverse('recipe:recipe-list')
+RECIPES_BULK_URL = reverse('recipe:recipe-bulk-create')
 
+@lru_cache(maxsize=None)
 def detail_url(recipe_id):
     """Create and return a recipe detail URL"""
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
+@lru_cache(maxsize=None)
 def image_upload_url(recipe_id):
     """Create and return an image upload URL"""
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
+RECIPE_DEFAULTS = {
+    'title': 'Sample recipe',
+    'time_minutes': 16,
+    'price': Decimal('3.16'),
+    'description': 'Sample description',
+    'link': 'http://example.com/recipe.pdf',
+}
+
 def create_recipe(user, **params):
     """Create and return a sample recipe"""
-    defaults = {
-        'title': 'Sample recipe',
-        'time_minutes': 16,
-        'price': Decimal('3.16'),
-        'description': 'Sample description',
-        'link': 'http://example.com/recipe.pdf',
-    }
+    defaults = RECIPE_DEFAULTS.copy()
     defaults.update(params)
 
     recipe = Recipe.objects.create(user=user, **defaults)
     return recipe
 
+
+def create_recipes(user, params_list):
+    """Create and return sample recipes with a single INSERT"""
+    return Recipe.objects.bulk_create([
+        Recipe(user=user, **{**RECIPE_DEFAULTS, **params})
+        for params in params_list
+    ])
+
 class PublicRecipeApiTests(TestCase):
     """Test unauthenticated recipe API request"""
 
@@ -62,19 +81,21 @@ class PublicRecipeApiTests(TestCase):
 class PrivateRecipeApiTests(TestCase):
     """Test authenticated recipe API requests"""
 
-    def setUp(self):
-        self.client = APIClient()
-        self.user = get_user_model().objects.create_user(
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
             'user@example.com',
             'password123',
         )
+
+    def setUp(self):
+        self.client = APIClient()
         self.client.force_authenticate(self.user)
 
     def test_retrieve_recipes(self):
         """Test retrieving a list of recipes"""
 
-        create_recipe(user=self.user)
-        create_recipe(user=self.user)
+        create_recipes(user=self.user, params_list=[{}, {}])
 
         # Simulate a GET request and store the response
         resp = self.client.get(RECIPES_URL)
@@ -87,6 +108,23 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertEqual(resp.data, serializer.data)
 
+    def test_list_recipes_query_count(self):
+        """Test listing recipes does not query per recipe or tag"""
+        tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ['vegan', 'dessert', 'lunch']
+        ]
+        recipes = create_recipes(user=self.user, params_list=[{}] * 5)
+        for recipe in recipes:
+            recipe.tags.add(*tags)
+
+        # list ETag, recipes and their tags
+        with self.assertNumQueries(3):
+            resp = self.client.get(RECIPES_URL)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data), 5)
+
     def test_recipes_limited_to_user(self):
         """Test list of recipes is limited to the authenticated user"""
         other_user = get_user_model().objects.create_user(
@@ -121,6 +159,20 @@ class PrivateRecipeApiTests(TestCase):
         # Assert the resp is the same as the serialized data from db
         self.assertEqual(resp.data, serializer.data)
 
+    def test_view_recipe_detail_query_count(self):
+        """Test recipe detail loads the recipe and its tags in two queries"""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(
+            Tag.objects.create(user=self.user, name='breakfast'),
+            Tag.objects.create(user=self.user, name='brunch'),
+        )
+
+        with self.assertNumQueries(2):
+            resp = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data['tags']), 2)
+
     def test_create_recipe(self):
         """Test creating a recipe"""
         payload = {
@@ -136,6 +188,88 @@ class PrivateRecipeApiTests(TestCase):
             self.assertEqual(v, getattr(recipe, k))
         self.assertEqual(recipe.user, self.user)
 
+    def test_bulk_create_recipes(self):
+        """Test creating several recipes with tags in one request"""
+        tag_thai = Tag.objects.create(user=self.user, name='thai')
+        payload = [
+            {
+                'title': 'Green curry',
+                'time_minutes': 30,
+                'price': Decimal('9.50'),
+                'tags': [{'name': 'Thai'}, {'name': 'dinner'}],
+            },
+            {
+                'title': 'Pad thai',
+                'time_minutes': 20,
+                'price': Decimal('8.00'),
+                'tags': [{'name': 'thai'}],
+            },
+            {
+                'title': 'Toast',
+                'time_minutes': 5,
+                'price': Decimal('1.00'),
+            },
+        ]
+        resp = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(resp.data), 3)
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(
+            [recipe.title for recipe in recipes],
+            [item['title'] for item in payload],
+        )
+        curry, pad_thai, toast = recipes
+        self.assertEqual(
+            sorted(tag.name for tag in curry.tags.all()), ['dinner', 'thai'],
+        )
+        self.assertEqual(list(pad_thai.tags.all()), [tag_thai])
+        self.assertEqual(toast.tags.count(), 0)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(
+            resp.data[1]['tags'], [{'id': tag_thai.id, 'name': 'thai'}],
+        )
+
+    def test_bulk_create_recipes_invalid(self):
+        """Test an invalid item rejects the whole bulk request"""
+        payload = [
+            {'title': 'Soup', 'time_minutes': 10, 'price': Decimal('2.00')},
+            {'title': 'No price', 'time_minutes': 10},
+        ]
+        resp = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+    def test_bulk_create_recipes_too_many(self):
+        """Test a bulk request over the size limit is rejected"""
+        item = {'title': 'Soup', 'time_minutes': 10, 'price': '2.00'}
+        payload = [item] * (BulkRecipeListSerializer.max_length + 1)
+
+        resp = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', resp.data)
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+    def test_partial_update(self):
+        """Test partial update of a recipe only changes the sent fields"""
+        original_link = 'https://example.com/recipe.pdf'
+        recipe = create_recipe(
+            user=self.user,
+            title='Sample recipe title',
+            link=original_link,
+        )
+
+        payload = {'title': 'New recipe title'}
+        resp = self.client.patch(detail_url(recipe.id), payload)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, payload['title'])
+        self.assertEqual(recipe.link, original_link)
+        self.assertEqual(recipe.user, self.user)
+
     def test_create_recipe_with_new_tags(self):
         """Test creating a recipe with new tags"""
         payload = {
@@ -155,6 +289,23 @@ class PrivateRecipeApiTests(TestCase):
             exists = recipe.tags.filter(name=tag['name']).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_with_tags_query_count(self):
+        """Test creating a recipe with tags runs a fixed number of queries"""
+        Tag.objects.create(user=self.user, name='thai')
+        payload = {
+            'title': 'thai curry',
+            'time_minutes': 30,
+            'price': Decimal('17.0'),
+            'tags': [{'name': 'thai'}, {'name': 'dinner'}]
+        }
+        # recipe INSERT, tag lookup, missing tag INSERT, tag refetch,
+        # through-table INSERT and the response's tags; no updated_at bump
+        with self.assertNumQueries(6):
+            resp = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(resp.data['tags']), 2)
+
     def test_create_recipe_with_existing_tags(self):
         """Test creating a recipe with existing tags"""
         tag_indian = Tag.objects.create(user=self.user, name='indian')
@@ -176,6 +327,23 @@ class PrivateRecipeApiTests(TestCase):
             exists = recipe.tags.filter(user=self.user, name=tag['name']).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_reuses_tags_case_insensitive(self):
+        """Test tag names are normalised before matching existing tags"""
+        tag_vegan = Tag.objects.create(user=self.user, name='vegan')
+        payload = {
+            'title': 'Vegan chilli',
+            'time_minutes': 40,
+            'price': Decimal('8.50'),
+            'tags': [{'name': 'Vegan '}, {'name': 'vegan'}, {'name': 'Spicy'}]
+        }
+        resp = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=resp.data['id'])
+        self.assertEqual(recipe.tags.count(), 2)
+        self.assertIn(tag_vegan, recipe.tags.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+
     def test_create_tag_on_update(self):
         """Test creating a tag when updating a recipe"""
         recipe = create_recipe(user=self.user)
@@ -208,6 +376,46 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(tag_lunch, recipe.tags.all())
         self.assertNotIn(tag_breakfast, recipe.tags.all())
 
+    def test_update_recipe_replaces_changed_tags_only(self):
+        """Test updating tags keeps, removes and adds the right tags"""
+        tag_breakfast = Tag.objects.create(user=self.user, name='breakfast')
+        tag_lunch = Tag.objects.create(user=self.user, name='lunch')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag_breakfast, tag_lunch)
+
+        payload = {
+            'tags': [{'name': 'lunch'}, {'name': 'dinner'}]
+        }
+        resp = self.client.patch(detail_url(recipe.id), payload, format='json')
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(tag['name'] for tag in resp.data['tags']),
+            ['dinner', 'lunch'],
+        )
+        self.assertNotIn(tag_breakfast, recipe.tags.all())
+        self.assertIn(tag_lunch, recipe.tags.all())
+        self.assertTrue(recipe.tags.filter(name='dinner').exists())
+
+    def test_update_recipe_same_tags_skips_writes(self):
+        """Test resending a recipe's current tags does not write to the db"""
+        tag = Tag.objects.create(user=self.user, name='lunch')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag)
+
+        payload = {
+            'tags': [{'name': 'Lunch'}]
+        }
+        # fetch the recipe, prefetch its tags and reload them for the
+        # response; nothing is written
+        with self.assertNumQueries(3):
+            resp = self.client.patch(
+                detail_url(recipe.id), payload, format='json',
+            )
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(recipe.tags.all()), [tag])
+
     def test_clear_recipe_tags(self):
         """Test clearing a recipes tags"""
         tag = Tag.objects.create(user=self.user, name='Dessert')
@@ -224,13 +432,15 @@ class PrivateRecipeApiTests(TestCase):
 
     def test_filter_by_tags(self):
         """Test filtering recipes by tags"""
-        r1 = create_recipe(user=self.user, title='Thai Vegan Curry')
-        r2 = create_recipe(user=self.user, title='Aubergine Noodles')
+        r1, r2, r3 = create_recipes(user=self.user, params_list=[
+            {'title': 'Thai Vegan Curry'},
+            {'title': 'Aubergine Noodles'},
+            {'title': 'Fish and chips'},
+        ])
         tag1 = Tag.objects.create(user=self.user, name='Vegan')
         tag2 = Tag.objects.create(user=self.user, name='Vegetarian')
         r1.tags.add(tag1)
         r2.tags.add(tag2)
-        r3 = create_recipe(user=self.user, title='Fish and chips')
 
         params = {'tags': f'{tag1.id}, {tag2.id}'}
         resp = self.client.get(RECIPES_URL, params)
@@ -242,15 +452,81 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(s2.data, resp.data)
         self.assertNotIn(s3.data, resp.data)
 
+    def test_filter_by_tags_unique(self):
+        """Test a recipe matching several filter tags is returned once"""
+        recipe = create_recipe(user=self.user)
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Curry')
+        recipe.tags.add(tag1, tag2)
+
+        params = {'tags': f'{tag1.id},{tag2.id}'}
+        resp = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data), 1)
+        self.assertEqual(resp.data[0]['id'], recipe.id)
+
+    def test_filter_by_invalid_tags(self):
+        """Test filtering by malformed tag IDs returns a bad request"""
+        for tags in ['1,abc', '1,,2', '-1', '1.5', ',']:
+            with self.subTest(tags=tags):
+                resp = self.client.get(RECIPES_URL, {'tags': tags})
+
+                self.assertEqual(
+                    resp.status_code, status.HTTP_400_BAD_REQUEST
+                )
+                self.assertIn('tags', resp.data)
+
+    def test_list_recipes_not_modified(self):
+        """Test an unchanged recipe list is answered with 304"""
+        create_recipe(user=self.user)
+        resp = self.client.get(RECIPES_URL)
+        etag = resp['ETag']
+
+        resp = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_recipes_modified(self):
+        """Test changes to recipes or their tags change the list ETag"""
+        tag = Tag.objects.create(user=self.user, name='lunch')
+        other_tag = Tag.objects.create(user=self.user, name='dinner')
+        recipe = create_recipe(user=self.user)
+        other = create_recipe(user=self.user)
+        changes = [
+            lambda: self.client.patch(
+                detail_url(recipe.id), {'tags': [{'name': 'lunch'}]},
+                format='json',
+            ),
+            lambda: recipe.tags.add(other_tag),
+            lambda: recipe.tags.remove(other_tag),
+            lambda: other_tag.recipe_set.add(recipe, other),
+            lambda: other_tag.recipe_set.clear(),
+            lambda: Tag.objects.filter(pk=tag.pk).get().save(),
+            lambda: tag.delete(),
+            lambda: other.delete(),
+        ]
+        etag = self.client.get(RECIPES_URL)['ETag']
+        for change in changes:
+            change()
+            resp = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(resp['ETag'], etag)
+            etag = resp['ETag']
+
 class RecipeImageUploadTests(TestCase):
     """Tests for image upload API"""
 
-    def setUp(self):
-        self.client = APIClient()
-        self.user = get_user_model().objects.create_user(
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
             'user@example.com',
             'password123',
         )
+
+    def setUp(self):
+        self.client = APIClient()
         self.client.force_authenticate(self.user)
         self.recipe = create_recipe(user=self.user)
 
@@ -260,19 +536,21 @@ class RecipeImageUploadTests(TestCase):
     def test_upload_image_to_recipe(self):
         """Test uploading an image to a recipe"""
         url = image_upload_url(self.recipe.id)
-        with tempfile.NamedTemporaryFile(suffix = '.jpg') as image_file:
-            img = Image.new('RGB', (10, 10))
-            img.save(image_file, format='JPEG')
-            image_file.seek(0)
-            payload = {
-                'image': image_file,
-            }
+        buf = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(buf, format='JPEG')
+        payload = {
+            'image': SimpleUploadedFile(
+                'test.jpg', buf.getvalue(), content_type='image/jpeg',
+            ),
+        }
+        # fetch the recipe's image column and update it, nothing else
+        with self.assertNumQueries(2):
             resp = self.client.post(url, payload, format='multipart')
-            self.recipe.refresh_from_db()
+        self.recipe.refresh_from_db()
 
-            self.assertEqual(resp.status_code, status.HTTP_200_OK)
-            self.assertIn('image', resp.data)
-            self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn('image', resp.data)
+        self.assertTrue(os.path.exists(self.recipe.image.path))
 
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image"""
@@ -281,3 +559,19 @@ class RecipeImageUploadTests(TestCase):
 
         resp = self.client.post(url, payload, format='multipart')
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_non_image_file_bad_request(self):
+        """Test uploading a file that is not an image"""
+        url = image_upload_url(self.recipe.id)
+        payload = {
+            'image': SimpleUploadedFile(
+                'test.jpg', b'not an image', content_type='image/jpeg',
+            ),
+        }
+
+        resp = self.client.post(url, payload, format='multipart')
+        self.recipe.refresh_from_db()
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', resp.data)
+        self.assertFalse(self.recipe.image)
@@ -1,6 +1,8 @@
 """
 Tests for the tags API.
 """
+from functools import lru_cache
+
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
@@ -14,6 +16,7 @@ from recipe.serializers import TagSerializer
 
 TAGS_URL = reverse('recipe:tag-list')
 
+@lru_cache(maxsize=None)
 def detail_url(tag_id):
     """Create and return a detail URL for a tag."""
     return reverse('recipe:tag-detail', args=[tag_id])
@@ -36,8 +39,11 @@ class PublicTagsApiTests(TestCase):
 class PrivateTagsApiTests(TestCase):
     """Test authenticated API requests."""
 
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+
     def setUp(self):
-        self.user = create_user()
         self.client = APIClient()
         self.client.force_authenticate(self.user)
 
@@ -55,6 +61,31 @@ class PrivateTagsApiTests(TestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertEqual(resp.data, serializer.data)
 
+    def test_list_tags_query_count(self):
+        """Test listing tags does not query per tag."""
+        Tag.objects.bulk_create(
+            Tag(user=self.user, name=f'tag{i}') for i in range(5)
+        )
+
+        # list ETag and tags
+        with self.assertNumQueries(2):
+            resp = self.client.get(TAGS_URL)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data), 5)
+
+    def test_list_tags_not_modified(self):
+        """Test an unchanged tag list is answered with 304."""
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        etag = self.client.get(TAGS_URL)['ETag']
+
+        resp = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(detail_url(tag.id), {'name': 'dessert'})
+        resp = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
     def test_tags_limited_to_user(self):
         """Test list of tags is limited to the authenticated user."""
         user2 = create_user(email='user2@example.com')
@@ -80,6 +111,27 @@ class PrivateTagsApiTests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_update_tag_duplicate_name(self):
+        """Test renaming a tag onto an existing name is rejected."""
+        Tag.objects.create(user=self.user, name='dinner')
+        tag = Tag.objects.create(user=self.user, name='supper')
+
+        resp = self.client.patch(detail_url(tag.id), {'name': ' Dinner '})
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('name', resp.data)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'supper')
+
+    def test_update_tag_same_name(self):
+        """Test resending a tag's own name in another case is allowed."""
+        tag = Tag.objects.create(user=self.user, name='dinner')
+
+        resp = self.client.patch(detail_url(tag.id), {'name': 'Dinner'})
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['name'], 'dinner')
+
     def test_delete_tag(self):
         """Test deleting a tag."""
         tag1 = Tag.objects.create(user=self.user, name="Breakfast")
@@ -116,18 +168,20 @@ class PrivateTagsApiTests(TestCase):
         tag1 = Tag.objects.create(user=self.user, name="breakfast")
         tag2 = Tag.objects.create(user=self.user, name="dinner")
 
-        recipe1 = Recipe.objects.create(
-            title='Pancakes',
-            time_minutes=5,
-            price=3.00,
-            user=self.user,
-        )
-        recipe2 = Recipe.objects.create(
-            title='Porridge',
-            time_minutes=3,
-            price=2.00,
-            user=self.user,
-        )
+        recipe1, recipe2 = Recipe.objects.bulk_create([
+            Recipe(
+                title='Pancakes',
+                time_minutes=5,
+                price=3.00,
+                user=self.user,
+            ),
+            Recipe(
+                title='Porridge',
+                time_minutes=3,
+                price=2.00,
+                user=self.user,
+            ),
+        ])
         recipe1.tags.add(tag1)
         recipe2.tags.add(tag1)
 
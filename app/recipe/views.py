@@ -1,20 +1,36 @@
 """
 Views for the recipe APIs
 """
+import hashlib
+import logging
+import re
+from collections import defaultdict
+
 from drf_spectacular.utils import (
     extend_schema_view,
     extend_schema,
     OpenApiParameter,
     OpenApiTypes,
 )
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Exists, Max, OuterRef
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import (
     viewsets,
     mixins,
     status,
 )
+from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import (
+    DecimalField,
+    ImageField,
+    empty,
+    get_error_detail,
+)
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 
 from core.models import (
@@ -23,6 +39,49 @@ from core.models import (
 )
 from recipe import serializers
 
+logger = logging.getLogger(__name__)
+
+# both are stateless, so every request can share one instance
+AUTHENTICATORS = (TokenAuthentication(),)
+PERMISSIONS = (IsAuthenticated(),)
+
+# formats prices in the recipe list exactly as RecipeSerializer would
+PRICE_FIELD = DecimalField(max_digits=5, decimal_places=2)
+
+# comma-separated IDs, e.g. "1,2" or "1, 2"
+_TAG_IDS_RE = re.compile(r'\s*\d+\s*(?:,\s*\d+\s*)*')
+
+
+def _version(queryset):
+    """Return a value that changes when a row is added, edited or deleted"""
+    return tuple(queryset.aggregate(Count('id'), Max('updated_at')).values())
+
+
+def _list_etag(request, *versions):
+    """Hash the versions with everything else the list response depends on"""
+    key = (
+        request.user.pk,
+        request.get_full_path(),
+        request.accepted_renderer.format,
+    ) + versions
+    return hashlib.md5(repr(key).encode()).hexdigest()
+
+
+def recipe_list_etag(request, *args, **kwargs):
+    """ETag of the authenticated user's recipe list"""
+    # tag changes bump updated_at of their recipes, see core.signals
+    recipes = Recipe.objects.filter(user=request.user)
+    return _list_etag(request, _version(recipes))
+
+
+def tag_list_etag(request, *args, **kwargs):
+    """ETag of the authenticated user's tag list"""
+    versions = (_version(Tag.objects.filter(user=request.user)),)
+    if 'assigned_only' in request.query_params:
+        # which tags are assigned changes with the recipes
+        versions += (_version(Recipe.objects.filter(user=request.user)),)
+    return _list_etag(request, *versions)
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -35,52 +94,130 @@ from recipe import serializers
         ]
     )
 )
+@method_decorator(condition(etag_func=recipe_list_etag), name='list')
 class RecipeViewSet(viewsets.ModelViewSet):
     """View for manage recipe APIs"""
-    # serializer_class = serializers.RecipeDetailSerializer
+    serializer_class = serializers.RecipeDetailSerializer
+    # serializers for actions that don't use serializer_class
+    action_serializer_classes = {
+        'list': serializers.RecipeListSerializer,
+        'bulk_create': serializers.RecipeSerializer,
+        'upload_image': serializers.RecipeImageSerializer,
+    }
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [IsAuthenticated]
+    image_field = ImageField()
+
+    def get_authenticators(self):
+        """Return the shared authenticator instances"""
+        return AUTHENTICATORS
 
-    def _params_to_int_list(self, qs):
-        """Convert a a comma-separated string of IDs to a list of integer IDs"""
-        return [int(str_id) for str_id in qs.split(',')]
+    def get_permissions(self):
+        """Return the shared permission instances"""
+        return PERMISSIONS
 
     def get_queryset(self):
         """Retrieve the recipes for the authenticated user"""
-        # return self.queryset.filter(user=self.request.user).order_by('-id')
-        tags = self.request.query_params.get('tags')
-        queryset = self.queryset
+        request = self.request
+        user = request.user
+        queryset = self.queryset.filter(user=user)
+        if self.action == 'upload_image':
+            # the upload only reads and writes the image column
+            return queryset.only('id', 'user_id', 'image')
+
+        tags = request.query_params.get('tags')
         if tags:
-            tag_ids = self._params_to_int_list(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            if not _TAG_IDS_RE.fullmatch(tags):
+                raise ValidationError(
+                    {'tags': 'Must be a comma-separated list of IDs.'}
+                )
+            tag_ids = tuple(map(int, tags.split(',')))
+            # EXISTS instead of a JOIN, so no duplicate rows to dedupe
+            queryset = queryset.filter(Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe_id=OuterRef('pk'),
+                    tag_id__in=tag_ids,
+                )
+            ))
 
-        return queryset.filter(user=self.request.user).order_by('-id').distinct()
+        return queryset.prefetch_related('tags').order_by('-id')
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
+        return self.action_serializer_classes.get(
+            self.action, self.serializer_class
+        )
+
+    def _tags_by_recipe(self, recipe_ids):
+        """Return the tags of the given recipes as dicts, keyed by recipe"""
+        tags = defaultdict(list)
+        rows = Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids,
+        ).order_by('-tag__name').values_list(
+            'recipe_id', 'tag_id', 'tag__name',
+        )
+        for recipe_id, tag_id, name in rows:
+            tags[recipe_id].append({'id': tag_id, 'name': name})
+        return tags
 
-        if self.action == "list":
-            return serializers.RecipeSerializer
-        elif self.action == "upload_image":
-            return serializers.RecipeImageSerializer
+    def list(self, request, *args, **kwargs):
+        """List the authenticated user's recipes"""
+        # rendered from values() rows instead of serializing instances
+        queryset = self.filter_queryset(self.get_queryset())
+        recipes = list(queryset.prefetch_related(None).values(
+            'id', 'title', 'time_minutes', 'price', 'link',
+        ))
+        tags = self._tags_by_recipe([recipe['id'] for recipe in recipes])
+        for recipe in recipes:
+            recipe['price'] = PRICE_FIELD.to_representation(recipe['price'])
+            recipe['tags'] = tags[recipe['id']]
 
-        return serializers.RecipeDetailSerializer
+        page = self.paginate_queryset(recipes)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(recipes)
 
     def perform_create(self, serializer):
         """Create a new recipe"""
         serializer.save(user=self.request.user)
 
+    @extend_schema(
+        request=serializers.RecipeSerializer(many=True),
+        responses={201: serializers.RecipeSerializer(many=True)},
+    )
+    @action(methods=['POST'], detail=False, url_path='bulk')
+    def bulk_create(self, request):
+        """Create several recipes in one request"""
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
-    def upload_image(self, requset, pk=None):
+    def upload_image(self, request, pk=None):
         """Upload an image to recipe"""
         recipe = self.get_object()
-        serializer = self.get_serializer(recipe, data=requset.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        print(f"Error: {serializer.errors}")
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # validate the single file field without a full serializer
+        try:
+            image = self.image_field.run_validation(
+                request.data.get('image', empty)
+            )
+        except ValidationError as exc:
+            errors = {'image': exc.detail}
+        except DjangoValidationError as exc:
+            errors = {'image': get_error_detail(exc)}
+        else:
+            recipe.image = image
+            recipe.save(update_fields=['image', 'updated_at'])
+            return Response(
+                {
+                    'id': recipe.id,
+                    'image': request.build_absolute_uri(recipe.image.url),
+                },
+                status=status.HTTP_200_OK,
+            )
+
+        logger.debug('upload_image errors: %s', errors)
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
 
 @extend_schema_view(
     list=extend_schema(
@@ -93,23 +230,47 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ]
     )
 )
+@method_decorator(condition(etag_func=tag_list_etag), name='list')
 class TagViewSet(mixins.DestroyModelMixin,
                 mixins.UpdateModelMixin,
                 mixins.ListModelMixin, viewsets.GenericViewSet):
     """Manage tags in the database"""
 
     serializer_class = serializers.TagSerializer
+    action_serializer_classes = {
+        'list': serializers.TagListSerializer,
+    }
     queryset = Tag.objects.all()
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [IsAuthenticated]
+
+    def get_authenticators(self):
+        """Return the shared authenticator instances"""
+        return AUTHENTICATORS
+
+    def get_permissions(self):
+        """Return the shared permission instances"""
+        return PERMISSIONS
+
+    def get_serializer_class(self):
+        """Return the serializer class for request."""
+        return self.action_serializer_classes.get(
+            self.action, self.serializer_class
+        )
 
     def get_queryset(self):
         """Filter the tags for the authenticated user"""
-        assigned_only = bool(int(self.request.query_params.get('assigned_only', 0)))
-        queryset = self.queryset
+        request = self.request
+        user = request.user
+        assigned_only = bool(int(request.query_params.get('assigned_only', 0)))
+        queryset = self.queryset.filter(user=user)
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
-        return queryset.filter(user=self.request.user).order_by('-name').distinct()
+            # semi-join on the through table; no JOIN duplicates to dedupe
+            queryset = queryset.filter(Exists(
+                Recipe.tags.through.objects.filter(tag_id=OuterRef('pk'))
+            ))
+        if self.action == 'list':
+            # TagListSerializer renders nothing else
+            queryset = queryset.only('id', 'name')
+        return queryset.order_by('-name')
 
 
 
@@ -1,6 +1,6 @@
 """Tests for the user API"""
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
@@ -10,11 +10,14 @@ from rest_framework import status
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
+# a fast hasher; the default PBKDF2 dominates the cost of these tests
+FAST_PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
 
 def create_user(**params):
     """Create and return a new user"""
     return get_user_model().objects.create_user(**params)
 
+@override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
 class PublicUserApiTests(TestCase):
     """test the public features of the user API."""
 
@@ -104,6 +107,7 @@ class PublicUserApiTests(TestCase):
 
         self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
 
+@override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
 class PrivateUserApiTests(TestCase):
     """Test API requests that require authentication"""
 